@@ -1,41 +1,245 @@
+import asyncio
+import ctypes
+import errno
+import hashlib
+import io
+import mmap
 import os
 import re
 import shutil
+import string
+import sys
+from collections import Counter
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from itertools import islice
 from pypdf import PdfReader
 from pypdf.errors import PdfReadError
-from openai import OpenAI
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
 
-
-# Create an OpenAI client using the API key provided in the environment.
+try:
+    from zpdf import Document as ZpdfDocument
+except ImportError:
+    ZpdfDocument = None
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+# PCRE2 JIT-compiles patterns to native code; fall back to the stdlib engine
+# when it is not installed.
+try:
+    import pcre2 as re_engine
+    from pcre2.exceptions import CompileError as _PatternError
+    COMPILE_KW = {"jit": True}
+except ImportError:
+    re_engine = re
+    _PatternError = re.error
+    COMPILE_KW = {}
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    from llama_cpp import Llama
+except ImportError:
+    Llama = None
+
+
+# Read the OpenAI API key from the environment; a client is opened per batch of titles.
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-CLIENT = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+# Maximum number of ChatGPT requests in flight at once.
+TITLE_CONCURRENCY = 10
+TITLE_MODEL = "gpt-3.5-turbo"
+TITLE_SYSTEM_PROMPT = (
+    "You generate short and descriptive filenames. Filenames start with the client name, "
+    "then then project name. Filenames may have spaces but may not have other punctuation. "
+    "Do not include REES in the name of the file."
+)
+# Set OPENAI_BACKEND=local to generate titles with a llama.cpp model at LOCAL_MODEL_PATH.
+OPENAI_BACKEND = os.getenv("OPENAI_BACKEND", "openai").strip().lower()
+LOCAL_MODEL_PATH = os.getenv("LOCAL_MODEL_PATH")
+# Room for the system prompt plus PROMPT_CHAR_LIMIT characters of document text.
+LOCAL_CONTEXT_TOKENS = 4096
+_LOCAL_MODEL = None
+
+# Only the opening pages are needed to come up with a title.
+MAX_PAGES = 6
+# Amount of document text sent along with the title request.
+PROMPT_CHAR_LIMIT = 4000
+
+
+def _compile(pattern: str):
+    """Compile pattern with re_engine, or with re if the engine cannot stand in for it."""
+    try:
+        compiled = re_engine.compile(pattern, **COMPILE_KW)
+    except _PatternError:
+        return re.compile(pattern)
+    if not (hasattr(compiled, "sub") and hasattr(compiled, "fullmatch")):
+        return re.compile(pattern)
+    return compiled
+
+
+# Tables and patterns used for every candidate title, built once at import time.
+_INVALID_TRANS = str.maketrans(dict.fromkeys('\\/:*?"<>|', '_'))
+_SANITIZE_DISALLOWED = _compile(r'[^A-Za-z0-9 _]+')
+# Collapses runs of underscores or of spaces in a single pass. Always compiled
+# with re: the r'\1' replacement relies on re's template syntax, not PCRE2's.
+_SANITIZE_RUNS = re.compile(r'([ _])\1+')
+_VALID_NAME_BYTES = (string.ascii_letters + string.digits + ' _').encode()
+
+
+def _only_allowed_chars(name: str) -> bool:
+    """Return True if name has no characters besides letters, numbers, spaces or underscores."""
+    # Deleting every allowed byte leaves nothing behind for such a name.
+    return name.isascii() and not name.encode().translate(None, _VALID_NAME_BYTES)
 
 
 def sanitize_filename(name: str) -> str:
     """Sanitize a filename by removing unsupported characters."""
-    sanitized = re.sub(r'[\\/:*?"<>|]', '_', name)
-    sanitized = re.sub(r'[^A-Za-z0-9 _]+', '', sanitized)
-    sanitized = re.sub(r'__+', '_', sanitized)
-    sanitized = re.sub(r'\s{2,}', ' ', sanitized)
-    sanitized = sanitized.strip(' _')
-    if len(sanitized) > 200:
-        sanitized = sanitized[:200]
-    return sanitized
+    sanitized = name.translate(_INVALID_TRANS)
+    # Cheap literal checks first; most titles need neither regex pass.
+    if not _only_allowed_chars(sanitized):
+        sanitized = _SANITIZE_DISALLOWED.sub('', sanitized)
+    if '__' in sanitized or '  ' in sanitized:
+        sanitized = _SANITIZE_RUNS.sub(r'\1', sanitized)
+    return sanitized.strip(' _')[:200]
 
 
 def is_valid_filename(name: str) -> bool:
     """Return True if the name contains only letters, numbers, spaces or underscores."""
-    return bool(re.fullmatch(r"[A-Za-z0-9 _]+", name))
+    return bool(name) and _only_allowed_chars(name)
+
+
+def _prefetch(path: str) -> None:
+    """Ask the kernel to start reading the file into the page cache."""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    except OSError:
+        pass  # Only advice; extraction will read the file either way.
+    finally:
+        os.close(fd)
+
+
+def _read_pdf(pdf_path: str) -> io.BytesIO:
+    """Load the PDF into memory so pypdf's seeks do not hit the disk."""
+    with open(pdf_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise PdfReadError("Cannot read an empty file")
+        if hasattr(os, "posix_fadvise"):
+            try:
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            except OSError:
+                pass  # Only advice; the read below works either way.
+        return io.BytesIO(f.read())
+
+
+def _iter_zpdf_pages(pdf_path: str, max_pages: int) -> Iterator[str]:
+    """Yield page text using zpdf."""
+    with ZpdfDocument(pdf_path) as doc:
+        for index in range(min(doc.page_count, max_pages)):
+            yield doc.extract_page(index)
+
+
+def _iter_pdfium_pages(pdf_path: str, max_pages: int) -> Iterator[str]:
+    """Yield page text using PDFium."""
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        for index in range(min(len(pdf), max_pages)):
+            page = pdf[index]
+            textpage = page.get_textpage()
+            try:
+                yield textpage.get_text_range()
+            finally:
+                textpage.close()
+                page.close()
+    finally:
+        pdf.close()
+
+
+def _iter_pypdf_pages(pdf_path: str, max_pages: int) -> Iterator[str]:
+    """Yield page text using pypdf."""
+    reader = PdfReader(_read_pdf(pdf_path))
+    for page in islice(reader.pages, max_pages):
+        yield page.extract_text() or ""
+
+
+def iter_pages_text(pdf_path: str, max_pages: int = MAX_PAGES) -> Iterator[str]:
+    """Yield the text of the first max_pages pages of the PDF, one page at a time.
+
+    The fastest installed backend is tried first. If it fails or finds no text
+    before producing any, the next one is tried; pypdf is always the last resort
+    and its errors are left to the caller.
+    """
+    backends = []
+    if ZpdfDocument is not None:
+        backends.append(_iter_zpdf_pages)
+    if pdfium is not None:
+        backends.append(_iter_pdfium_pages)
+
+    for backend in backends:
+        produced_text = False
+        try:
+            with closing(backend(pdf_path, max_pages)) as pages:
+                for page_text in pages:
+                    # Empty pages add nothing, so hold off committing to this
+                    # backend until it yields some text.
+                    if not page_text:
+                        continue
+                    produced_text = True
+                    yield page_text
+        except Exception:
+            if produced_text:
+                raise
+        if produced_text:
+            return
+
+    yield from _iter_pypdf_pages(pdf_path, max_pages)
+
+
+def _content_hash(data) -> str:
+    """Hash a bytes-like object with xxHash when installed, else BLAKE2."""
+    if xxhash is not None:
+        return xxhash.xxh3_64(data).hexdigest()
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def file_digest(path: str) -> str | None:
+    """Return a hash of the file's contents, or None if it cannot be read."""
+    try:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return _content_hash(b"")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return _content_hash(mm)
+    except OSError:
+        return None
 
 
 def extract_text_from_pdf(pdf_path: str) -> str | None:
-    """Read all text from the PDF."""
+    """Read text from the opening pages, stopping once there is enough for a title prompt."""
     try:
-        reader = PdfReader(pdf_path)
-        text = "".join(page.extract_text() or "" for page in reader.pages)
-        return text
+        text_parts = []
+        length = 0
+        with closing(iter_pages_text(pdf_path)) as pages:
+            for page_text in pages:
+                text_parts.append(page_text)
+                length += len(page_text)
+                if length >= PROMPT_CHAR_LIMIT:
+                    break
+        return "".join(text_parts)
     except PdfReadError:
         print(f"  [ERROR] Could not read '{os.path.basename(pdf_path)}'.")
         return None
@@ -46,40 +250,147 @@ def extract_text_from_pdf(pdf_path: str) -> str | None:
 
 def get_last_line(text: str) -> str | None:
     """Return the last non-empty line from text."""
-    lines = [line.strip() for line in text.splitlines() if line.strip()]
-    if not lines:
+    text = text.rstrip()
+    if not text:
         return None
-    return sanitize_filename(lines[-1])
-
-
-def get_title_via_chatgpt(text: str) -> str | None:
+    # Look back for the last line break rather than splitting the whole text.
+    start = max(text.rfind('\n'), text.rfind('\r')) + 1
+    return sanitize_filename(text[start:].strip())
+
+
+def _title_messages(text: str) -> list[dict[str, str]]:
+    """Build the chat messages asking for a short filename for the document text."""
+    trimmed = text[:PROMPT_CHAR_LIMIT]
+    return [
+        {"role": "system", "content": TITLE_SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": f"Provide a short filename for this document:\n{trimmed}",
+        },
+    ]
+
+
+async def get_title_via_chatgpt(
+    client: AsyncOpenAI, filename: str, text: str, semaphore: asyncio.Semaphore
+) -> str | None:
     """Request a short title from ChatGPT using the document text."""
-    if not CLIENT:
-        print("  [ERROR] OPENAI_API_KEY environment variable not set.")
-        return None
-
-    trimmed = text[:4000]
     try:
-        response = CLIENT.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You generate short and descriptive filenames. Filenames start with the client name, then then project name. Filenames may have spaces but may not have other punctuation. Do not include REES in the name of the file.",
-                },
-                {
-                    "role": "user",
-                    "content": f"Provide a short filename for this document:\n{trimmed}",
-                },
-            ],
-            max_tokens=10,
-            temperature=0.2,
-        )
+        async with semaphore:
+            response = await client.chat.completions.create(
+                model=TITLE_MODEL,
+                messages=_title_messages(text),
+                max_tokens=10,
+                temperature=0.2,
+            )
         title = response.choices[0].message.content.strip()
         return sanitize_filename(title)
     except Exception as exc:
-        print(f"  [ERROR] ChatGPT title generation failed: {exc}")
+        print(f"  [ERROR] ChatGPT title generation failed for '{filename}': {exc}")
+        return None
+
+
+async def get_titles_via_chatgpt(documents: list[tuple[str, str]]) -> list[str | None]:
+    """Request titles for (filename, text) pairs concurrently, TITLE_CONCURRENCY at a time."""
+    if not OPENAI_API_KEY:
+        print("  [ERROR] OPENAI_API_KEY environment variable not set.")
+        return [None] * len(documents)
+
+    semaphore = asyncio.Semaphore(TITLE_CONCURRENCY)
+    async with AsyncOpenAI(api_key=OPENAI_API_KEY) as client:
+        return await asyncio.gather(*(
+            get_title_via_chatgpt(client, filename, text, semaphore)
+            for filename, text in documents
+        ))
+
+
+def get_titles_via_local_model(documents: list[tuple[str, str]]) -> list[str | None]:
+    """Generate titles for (filename, text) pairs with the local llama.cpp model."""
+    global _LOCAL_MODEL
+    if Llama is None:
+        print("  [ERROR] llama-cpp-python is not installed.")
+        return [None] * len(documents)
+    if not LOCAL_MODEL_PATH:
+        print("  [ERROR] LOCAL_MODEL_PATH environment variable not set.")
+        return [None] * len(documents)
+
+    if _LOCAL_MODEL is None:
+        try:
+            _LOCAL_MODEL = Llama(
+                model_path=LOCAL_MODEL_PATH, n_ctx=LOCAL_CONTEXT_TOKENS, n_batch=512, verbose=False
+            )
+        except Exception as exc:
+            print(f"  [ERROR] Could not load local model '{LOCAL_MODEL_PATH}': {exc}")
+            return [None] * len(documents)
+
+    titles = []
+    for filename, text in documents:
+        try:
+            response = _LOCAL_MODEL.create_chat_completion(
+                messages=_title_messages(text),
+                max_tokens=10,
+                temperature=0.2,
+            )
+            title = response["choices"][0]["message"]["content"].strip()
+            titles.append(sanitize_filename(title))
+        except Exception as exc:
+            print(f"  [ERROR] Local title generation failed for '{filename}': {exc}")
+            titles.append(None)
+    return titles
+
+
+# Title generators keyed by the OPENAI_BACKEND setting.
+_TITLE_BACKENDS = {
+    "openai": lambda documents: asyncio.run(get_titles_via_chatgpt(documents)),
+    "local": get_titles_via_local_model,
+}
+
+
+def get_titles(documents: list[tuple[str, str]]) -> list[str | None]:
+    """Generate titles for (filename, text) pairs with the backend selected by OPENAI_BACKEND."""
+    if not documents:
+        return []
+    backend = _TITLE_BACKENDS.get(OPENAI_BACKEND)
+    if backend is None:
+        print(f"  [ERROR] Unknown OPENAI_BACKEND '{OPENAI_BACKEND}'.")
+        return [None] * len(documents)
+    return backend(documents)
+
+
+def _load_renameat2():
+    """Return libc's renameat2 on Linux, or None where it is unavailable."""
+    if not sys.platform.startswith("linux"):
         return None
+    try:
+        renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+    except (OSError, AttributeError):
+        return None
+    renameat2.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint]
+    renameat2.restype = ctypes.c_int
+    return renameat2
+
+
+_RENAMEAT2 = _load_renameat2()
+_AT_FDCWD = -100
+_RENAME_NOREPLACE = 1
+
+
+def _rename_no_replace(src: str, dst: str) -> None:
+    """Rename src to dst, raising FileExistsError rather than overwriting dst."""
+    if _RENAMEAT2 is not None:
+        result = _RENAMEAT2(_AT_FDCWD, os.fsencode(src), _AT_FDCWD, os.fsencode(dst), _RENAME_NOREPLACE)
+        if result == 0:
+            return
+        err = ctypes.get_errno()
+        # ENOSYS/EINVAL: the kernel or filesystem does not support the flag.
+        # EEXIST on the same file: a case-only rename on a case-insensitive filesystem.
+        if err not in (errno.ENOSYS, errno.EINVAL) and not (
+            err == errno.EEXIST and os.path.samefile(src, dst)
+        ):
+            raise OSError(err, os.strerror(err), src, None, dst)
+
+    if os.path.exists(dst) and not os.path.samefile(src, dst):
+        raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dst)
+    os.rename(src, dst)
 
 
 def rename_pdfs_in_folder(folder_path: str, dry_run: bool = True) -> None:
@@ -90,65 +401,114 @@ def rename_pdfs_in_folder(folder_path: str, dry_run: bool = True) -> None:
     print(f"\n{'[DRY RUN] ' if dry_run else ''}Processing PDFs in: '{folder_path}'")
     print("------------------------------------------------------------------")
 
-    pdf_files_found = 0
+    with os.scandir(folder_path) as it:
+        listing = list(it)
+    pdf_entries = [e for e in listing if e.is_file() and e.name.lower().endswith('.pdf')]
+    # Lowercased names taken in the folder, counted since several files may share
+    # one. Kept current as renames are planned so that collision checks do not
+    # need a stat call per candidate.
+    existing = Counter(e.name.lower() for e in listing)
+    plan: list[tuple[str, str]] = []
+    pdf_files_found = len(pdf_entries)
+    # The per-file report is collected here and written out in one go at the end.
+    log: list[str] = []
     renamed_count = 0
     skipped_count = 0
 
-    for filename in os.listdir(folder_path):
-        if not filename.lower().endswith('.pdf'):
-            continue
-
-        pdf_files_found += 1
-        old_file_path = os.path.join(folder_path, filename)
-
-        print(f"\nProcessing '{filename}'...")
-        text_content = extract_text_from_pdf(old_file_path)
-
+    # Extract every file first, then send all title requests concurrently since
+    # they are network-bound. Files with identical contents are extracted and
+    # titled once. Target names are planned in listing order and the renames are
+    # performed in a single pass afterwards.
+    first_by_digest: dict[str, int] = {}
+    sources = []
+    for index, entry in enumerate(pdf_entries):
+        # Let the kernel read the next file while this one is being hashed.
+        if index + 1 < len(pdf_entries):
+            _prefetch(pdf_entries[index + 1].path)
+        digest = file_digest(entry.path)
+        sources.append(first_by_digest.setdefault(digest, index) if digest else index)
+
+    # Extraction is CPU-bound and PDFium is not thread-safe, so it runs in worker
+    # processes that each hold their own parser state.
+    unique = [index for index, source in enumerate(sources) if source == index]
+    texts: dict[int, str | None] = {}
+    if unique:
+        with ProcessPoolExecutor() as executor:
+            paths = [pdf_entries[index].path for index in unique]
+            texts = dict(zip(unique, executor.map(extract_text_from_pdf, paths)))
+    pending = [index for index, text in texts.items() if text]
+    titles = dict(zip(
+        pending, get_titles([(pdf_entries[index].name, texts[index]) for index in pending])
+    ))
+
+    for index, (entry, source) in enumerate(zip(pdf_entries, sources)):
+        filename = entry.name
+        old_file_path = entry.path
+
+        log.append(f"\nProcessing '{filename}'...")
+        if source != index:
+            log.append(f"  Identical to '{pdf_entries[source].name}'; reusing its result.")
+
+        text_content = texts[source]
         if not text_content:
-            print(f"  Skipping '{filename}' due to extraction error or empty content.")
+            log.append(f"  Skipping '{filename}' due to extraction error or empty content.")
             skipped_count += 1
             continue
 
-        title = get_title_via_chatgpt(text_content)
+        title = titles[source]
         if not title:
-            print(f"  Could not determine a new name for '{filename}'. Skipping.")
+            log.append(f"  Could not determine a new name for '{filename}'. Skipping.")
             skipped_count += 1
             continue
 
         if not is_valid_filename(title):
-            print(f"  Generated title contains unsupported characters. Skipping.")
+            log.append(f"  Generated title contains unsupported characters. Skipping.")
             skipped_count += 1
             continue
 
+        # Resolve collisions against the planned state of the folder, leaving the
+        # file's own name out so it never collides with itself.
+        existing[filename.lower()] -= 1
         new_filename = f"{title}.pdf"
-        new_file_path = os.path.join(folder_path, new_filename)
         counter = 1
-        while os.path.exists(new_file_path) and new_file_path != old_file_path:
+        while existing[new_filename.lower()] > 0:
             new_filename = f"{title}_{counter}.pdf"
-            new_file_path = os.path.join(folder_path, new_filename)
             counter += 1
 
-        if new_file_path == old_file_path:
-            print(f"  '{filename}' already has the desired name. No change needed.")
+        if new_filename == filename:
+            log.append(f"  '{filename}' already has the desired name. No change needed.")
+            existing[filename.lower()] += 1
             skipped_count += 1
+            continue
+
+        if dry_run:
+            log.append(f"  [DRY RUN] Would rename to: '{new_filename}'")
         else:
-            if dry_run:
-                print(f"  [DRY RUN] Would rename to: '{new_filename}'")
+            log.append(f"  Will rename to: '{new_filename}'")
+        existing[new_filename.lower()] += 1
+        plan.append((old_file_path, os.path.join(folder_path, new_filename)))
+
+    if dry_run:
+        renamed_count = len(plan)
+    else:
+        if plan:
+            log.append("")
+        for old_file_path, new_file_path in plan:
+            filename = os.path.basename(old_file_path)
+            try:
+                _rename_no_replace(old_file_path, new_file_path)
+                log.append(f"  Renamed '{filename}' to '{os.path.basename(new_file_path)}'")
                 renamed_count += 1
-            else:
-                try:
-                    os.rename(old_file_path, new_file_path)
-                    print(f"  Renamed '{filename}' to '{new_filename}'")
-                    renamed_count += 1
-                except Exception as exc:
-                    print(f"  [ERROR] Failed to rename '{filename}': {exc}")
-                    skipped_count += 1
-
-    print("\n------------------------------------------------------------------")
-    print("Summary:")
-    print(f"  Total PDFs found: {pdf_files_found}")
-    print(f"  { '[DRY RUN] ' if dry_run else '' }Files {'would be ' if dry_run else ''}renamed: {renamed_count}")
-    print(f"  Files skipped/errors: {skipped_count}")
+            except Exception as exc:
+                log.append(f"  [ERROR] Failed to rename '{filename}': {exc}")
+                skipped_count += 1
+
+    log.append("\n------------------------------------------------------------------")
+    log.append("Summary:")
+    log.append(f"  Total PDFs found: {pdf_files_found}")
+    log.append(f"  { '[DRY RUN] ' if dry_run else '' }Files {'would be ' if dry_run else ''}renamed: {renamed_count}")
+    log.append(f"  Files skipped/errors: {skipped_count}")
+    sys.stdout.write("\n".join(log) + "\n")
 
 
 def move_pdfs_to_folder(src_folder: str, dest_folder: str) -> None:
@@ -162,11 +522,12 @@ def move_pdfs_to_folder(src_folder: str, dest_folder: str) -> None:
             return
 
     moved_count = 0
-    for filename in os.listdir(src_folder):
-        if not filename.lower().endswith('.pdf'):
-            continue
+    with os.scandir(src_folder) as it:
+        pdf_entries = [e for e in it if e.is_file() and e.name.lower().endswith('.pdf')]
 
-        src_path = os.path.join(src_folder, filename)
+    for entry in pdf_entries:
+        filename = entry.name
+        src_path = entry.path
         dest_path = os.path.join(dest_folder, filename)
         counter = 1
         while os.path.exists(dest_path):